@@ -13,51 +13,81 @@
 """build tar archives from product software"""
 
 import argparse
+import atexit
+import concurrent.futures
+import errno
+import fcntl
+import functools
+import hashlib
 import logging
 import os
+import re
 import shutil
+import subprocess
 import sys
+import tarfile
 import time
+import types
 import typing
 
-import mako.exceptions
-import mako.template
-import sh
-
 logging.basicConfig(level=logging.DEBUG,
                     format="%(asctime)s %(levelname)s %(message)s")
 
-ARCH_MAPS = {
+PKG_CACHE_DIR = os.path.expanduser("~/.cache/bg-pkg")
+
+# Most cache entries kept; least recently used beyond this are evicted.
+PKG_CACHE_KEEP = 20
+
+# Background work-dir deletions still in flight; see Package.rm_work_dir.
+_pending_deletes = []
+
+
+def _wait_pending_deletes():
+    for proc in _pending_deletes:
+        proc.wait()
+
+
+atexit.register(_wait_pending_deletes)
+
+# Read-only so it stays hashable-by-identity and can't drift at runtime.
+ARCH_MAPS = types.MappingProxyType({
     "armhf": {
         "ipk": "arm_cortex-a7_neon-vfpv4",
     },
     "amd64": {
         "ipk": "amd64",
     },
-}
-
-deb_template = mako.template.Template("""\
-Package: ${pkg_name}
-Version: ${pkg_version}
-Section: ${pkg_section}
-Priority: ${pkg_priority}
-Architecture: ${pkg_arch}
-% if pkg_depends:
-Depends: ${pkg_depends}
-% endif
-Maintainer: ${pkg_maintainer}
-Description: ${pkg_description}""")
-
-ipk_template = mako.template.Template("""\
-Package: ${pkg_name}
-Version: ${pkg_version}
-Section: ${pkg_section}
-Architecture: ${pkg_arch}
-% if pkg_depends:
-Depends: ${pkg_depends}
-% endif
-Maintainer: ${pkg_maintainer}
-Description: ${pkg_description}""")
+})
+
+def _render_deb_control(pkg_name, pkg_version, pkg_section, pkg_priority,
+                        pkg_arch, pkg_depends, pkg_maintainer,
+                        pkg_description):
+    """Render the control file for a Debian package."""
+    control = (f"Package: {pkg_name}\n"
+               f"Version: {pkg_version}\n"
+               f"Section: {pkg_section}\n"
+               f"Priority: {pkg_priority}\n"
+               f"Architecture: {pkg_arch}\n")
+    if pkg_depends:
+        control += f"Depends: {pkg_depends}\n"
+    control += (f"Maintainer: {pkg_maintainer}\n"
+                f"Description: {pkg_description}")
+    return control
+
+
+def _render_ipk_control(pkg_name, pkg_version, pkg_section, pkg_priority,
+                        pkg_arch, pkg_depends, pkg_maintainer,
+                        pkg_description):
+    """Render the control file for an OpenWrt package."""
+    control = (f"Package: {pkg_name}\n"
+               f"Version: {pkg_version}\n"
+               f"Section: {pkg_section}\n"
+               f"Architecture: {pkg_arch}\n")
+    if pkg_depends:
+        control += f"Depends: {pkg_depends}\n"
+    control += (f"Maintainer: {pkg_maintainer}\n"
+                f"Description: {pkg_description}")
+    return control
 
 
 class WrongArchException(Exception):
@@ -65,6 +95,240 @@ class WrongArchException(Exception):
     pass
 
 
+@functools.lru_cache(maxsize=None)
+def dpkg_deb_version() -> typing.Optional[tuple]:
+    """Return the builder's dpkg-deb version tuple, or None if unknown."""
+    try:
+        out = subprocess.run(["dpkg-deb", "--version"], check=True,
+                             capture_output=True, text=True).stdout
+        m = re.search(r"version (\d+)\.(\d+)\.(\d+)", out.splitlines()[0])
+        if m:
+            return tuple(int(g) for g in m.groups())
+    except Exception as e:
+        logging.warning("dpkg-deb version check: %s", e)
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _aux_dir_listing(auxdir):
+    """Memoized listing of a control aux-file directory, so repeated
+    existence checks across packages cost one readdir total."""
+    try:
+        return frozenset(os.listdir(auxdir))
+    except FileNotFoundError:
+        return frozenset()
+
+
+def dpkg_deb_supports_zstd() -> bool:
+    """dpkg-deb gained zstd support (and --threads-max) in 1.21.18."""
+    ver = dpkg_deb_version()
+    return ver is not None and ver >= (1, 21, 18)
+
+
+def dpkg_deb_supports_root_owner_group() -> bool:
+    """dpkg-deb gained --root-owner-group in 1.19.0."""
+    ver = dpkg_deb_version()
+    return ver is not None and ver >= (1, 19, 0)
+
+
+# FICLONE from <linux/fs.h>: clone src's extents into dst (CoW reflink).
+FICLONE = 0x40049409
+
+
+def _reflink_file(src, dst):
+    """Clone src to dst via FICLONE, falling back to a regular copy."""
+    with open(src, "rb") as srcf, open(dst, "wb") as dstf:
+        try:
+            fcntl.ioctl(dstf.fileno(), FICLONE, srcf.fileno())
+            return
+        except OSError:
+            pass
+    # copyfile uses copy_file_range/sendfile where available.
+    shutil.copyfile(src, dst)
+
+
+def _reflink_copytree(src, dst):
+    """Mirror src at dst using CoW clones where the filesystem allows.
+
+    Unlike the hardlink copy, the result does not share inodes with the
+    proto area, so the work dir may be mutated safely."""
+    os.makedirs(dst)
+    shutil.copymode(src, dst)
+    with os.scandir(src) as entries:
+        for entry in entries:
+            dst_path = os.path.join(dst, entry.name)
+            if entry.is_symlink():
+                os.symlink(os.readlink(entry.path), dst_path)
+            elif entry.is_dir():
+                _reflink_copytree(entry.path, dst_path)
+            else:
+                _reflink_file(entry.path, dst_path)
+                shutil.copymode(entry.path, dst_path)
+
+
+def _parallel_copytree(src, dst):
+    """Byte-copy src to dst, fanning the per-file copies out to a
+    thread pool.
+
+    copyfile spends its time in sendfile/copy_file_range with the GIL
+    released, so the copies genuinely overlap; directory creation and
+    symlinks are handled serially."""
+    copies = []
+    symlinks = []
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel = os.path.relpath(dirpath, src)
+        dstdir = dst if rel == "." else os.path.join(dst, rel)
+        os.makedirs(dstdir, exist_ok=True)
+        shutil.copymode(dirpath, dstdir)
+        for dname in list(dirnames):
+            spath = os.path.join(dirpath, dname)
+            if os.path.islink(spath):
+                dirnames.remove(dname)
+                symlinks.append((spath, os.path.join(dstdir, dname)))
+        for fname in filenames:
+            spath = os.path.join(dirpath, fname)
+            dpath = os.path.join(dstdir, fname)
+            if os.path.islink(spath):
+                symlinks.append((spath, dpath))
+            else:
+                copies.append((spath, dpath))
+
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+        for f in [ex.submit(shutil.copyfile, spath, dpath)
+                  for spath, dpath in copies]:
+            f.result()
+
+    for spath, dpath in copies:
+        shutil.copymode(spath, dpath)
+    for spath, dpath in symlinks:
+        os.symlink(os.readlink(spath), dpath)
+
+
+def _hardlink_copytree(src, dst):
+    """Mirror src at dst, hardlinking regular files instead of copying.
+
+    The work area is read by the package build utility and then deleted,
+    so sharing inodes with the proto area is safe and turns an O(bytes)
+    copy into O(inodes) metadata operations."""
+    os.makedirs(dst)
+    shutil.copymode(src, dst)
+    with os.scandir(src) as entries:
+        for entry in entries:
+            dst_path = os.path.join(dst, entry.name)
+            if entry.is_symlink():
+                os.symlink(os.readlink(entry.path), dst_path)
+            elif entry.is_dir():
+                _hardlink_copytree(entry.path, dst_path)
+            else:
+                os.link(entry.path, dst_path)
+
+
+# deb member suffix per compressor, e.g. data.tar.zst for zstd.
+_TAR_EXTS = {"zstd": ".zst", "xz": ".xz", "gzip": ".gz", "none": ""}
+
+
+def _as_root(tarinfo):
+    # Equivalent of dpkg-deb --root-owner-group.
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = "root"
+    return tarinfo
+
+
+def _write_tar(path, srcdir, members, compresstype, compresslevel, jobs=0):
+    """Write members of srcdir to a compressed GNU tar at path, with
+    root ownership recorded on every entry."""
+    if compresstype == "zstd":
+        import zstandard
+        cctx = zstandard.ZstdCompressor(level=compresslevel,
+                                        threads=jobs or -1)
+        with open(path, "wb") as raw, \
+             cctx.stream_writer(raw) as zout, \
+             tarfile.open(mode="w|", fileobj=zout,
+                          format=tarfile.GNU_FORMAT) as tar:
+            for m in members:
+                tar.add(os.path.join(srcdir, m), arcname="./" + m,
+                        filter=_as_root)
+        return
+
+    if compresstype == "xz":
+        tar = tarfile.open(path, "w:xz", format=tarfile.GNU_FORMAT,
+                           preset=compresslevel)
+    elif compresstype == "gzip":
+        tar = tarfile.open(path, "w:gz", format=tarfile.GNU_FORMAT,
+                           compresslevel=compresslevel)
+    else:
+        tar = tarfile.open(path, "w", format=tarfile.GNU_FORMAT)
+    with tar:
+        for m in members:
+            tar.add(os.path.join(srcdir, m), arcname="./" + m,
+                    filter=_as_root)
+
+
+def _ar_member(arf, name, srcpath):
+    """Append srcpath to the open ar archive arf as member name."""
+    size = os.path.getsize(srcpath)
+    arf.write(b"%-16s%-12d%-6d%-6d%-8o%-10d\x60\n" %
+              (name.encode("ascii"), int(time.time()), 0, 0,
+               0o100644, size))
+    with open(srcpath, "rb") as srcf:
+        shutil.copyfileobj(srcf, arf)
+    if size % 2:
+        arf.write(b"\n")
+
+
+def _copy_deb_data_member(debpath, dstpath):
+    """Copy the data.tar member of a .deb to dstpath; returns the
+    member's name (data.tar.zst, data.tar.xz, ...)."""
+    with open(debpath, "rb") as debf:
+        debf.seek(8)  # past the b"!<arch>\n" global header
+        while True:
+            hdr = debf.read(60)
+            if len(hdr) < 60:
+                raise ValueError("%s has no data.tar member" % debpath)
+            name = hdr[:16].decode("ascii").rstrip()
+            size = int(hdr[48:58])
+            if name.startswith("data.tar"):
+                with open(dstpath, "wb") as dstf:
+                    remaining = size
+                    while remaining:
+                        buf = debf.read(min(1 << 20, remaining))
+                        dstf.write(buf)
+                        remaining -= len(buf)
+                return name
+            debf.seek(size + (size % 2), 1)
+
+
+def _cache_find(key):
+    """Return the cached data member for key, or None."""
+    try:
+        for name in os.listdir(PKG_CACHE_DIR):
+            # .tmp entries are in-flight (or crashed) deposits.
+            if name.startswith(key + ".") and not name.endswith(".tmp"):
+                return os.path.join(PKG_CACHE_DIR, name)
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def _prune_cache():
+    """Evict the least recently used cache entries beyond the cap, so
+    the cache can't grow without bound."""
+    try:
+        entries = [os.path.join(PKG_CACHE_DIR, name)
+                   for name in os.listdir(PKG_CACHE_DIR)]
+    except FileNotFoundError:
+        return
+    if len(entries) <= PKG_CACHE_KEEP:
+        return
+    entries.sort(key=os.path.getmtime)
+    for path in entries[:len(entries) - PKG_CACHE_KEEP]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
 def valid_distro_arch(distro, arch) -> bool:
     if distro == "debian" and arch in ["armhf", "amd64"]:
         return True
@@ -87,6 +351,9 @@ class Package:
     depends = None
     maintainer = None
     proto_dir = None
+    copy_mode = "hardlink"
+    incremental = False
+    in_process = False
 
     def __init__(self, distro, arch, version):
         self.distro = distro
@@ -97,8 +364,9 @@ class Package:
         if not arch in self.arches:
             raise WrongArchException("%s not a supported architecture" % arch)
 
+        self.ipk_arch = ARCH_MAPS[self.arch]["ipk"]
         self.deb_package_name = "%s_%s_%s.deb" % (self.name, self.version, self.arch)
-        self.ipk_package_name = "%s_%s_%s.ipk" % (self.name, self.version, ARCH_MAPS[self.arch]["ipk"])
+        self.ipk_package_name = "%s_%s_%s.ipk" % (self.name, self.version, self.ipk_arch)
 
         self.set_distro(distro)
 
@@ -109,7 +377,9 @@ class Package:
             self.package_name = self.deb_package_name
 
             self.pkg_arch = self.arch
-            self.work_dir = "%s_%s_%s" % (self.name, self.version, self.pkg_arch)
+            # Unversioned: the version is minted per run, and a
+            # versioned name would defeat --incremental reuse.
+            self.work_dir = "%s_%s" % (self.name, self.pkg_arch)
             self.deb_dir = os.path.join(self.work_dir, "DEBIAN")
             self.control_dir = self.deb_dir
 
@@ -118,29 +388,44 @@ class Package:
                 self._depends = self._depends + self.deb_arm_depends
             elif self.arch == "x86":
                 self._depends = self._depends + self.deb_x86_depends
-            self._template = deb_template
+            self._render_control = _render_deb_control
         elif distro == "openwrt":
             self.package_name = self.ipk_package_name
 
-            self.pkg_arch = ARCH_MAPS[self.arch]["ipk"]
-            self.work_dir = "%s_%s_%s" % (self.name, self.version, self.pkg_arch)
+            self.pkg_arch = self.ipk_arch
+            self.work_dir = "%s_%s" % (self.name, self.pkg_arch)
             self.ipk_dir = os.path.join(self.work_dir, "CONTROL")
             self.control_dir = self.ipk_dir
 
             self._depends = self.ipk_depends
-            self._template = ipk_template
+            self._render_control = _render_ipk_control
         elif distro == "archive":
             raise RuntimeError("archive not yet implemented")
         else:
             raise RuntimeError("unknown distro")
 
     def rm_work_dir(self):
-        """Delete the package's work directory."""
+        """Delete the package's work directory.
+
+        The directory is atomically renamed aside and unlinked by a
+        background rm, so the caller doesn't wait out tens of thousands
+        of unlinks; an atexit hook holds the process until pending
+        deletes finish."""
+        if not os.path.exists(self.work_dir):
+            return
+
+        doomed = "%s.deleting.%d.%d" % (self.work_dir, os.getpid(),
+                                        len(_pending_deletes))
         try:
-            if os.path.exists(self.work_dir):
+            os.rename(self.work_dir, doomed)
+            _pending_deletes.append(
+                subprocess.Popen(["rm", "-rf", doomed],
+                                 start_new_session=True))
+        except OSError:
+            try:
                 shutil.rmtree(self.work_dir)
-        except Exception as e:
-            logging.warning("rmtree %s: %s", self.work_dir, e)
+            except Exception as e:
+                logging.warning("rmtree %s: %s", self.work_dir, e)
 
     def mk_work_dir(self):
         """Make the package's work and control directories."""
@@ -151,73 +436,243 @@ class Package:
 
     def copy_tree(self):
         """Copy package contents, as subtree, from proto area."""
-        shutil.copytree(self.proto_dir, self.work_dir, symlinks=True)
+        if self.copy_mode == "copy":
+            _parallel_copytree(self.proto_dir, self.work_dir)
+        elif self.copy_mode == "reflink":
+            _reflink_copytree(self.proto_dir, self.work_dir)
+        else:
+            try:
+                _hardlink_copytree(self.proto_dir, self.work_dir)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # Work dir is on a different filesystem; fall back to a
+                # byte copy.
+                logging.info("cannot hardlink from %s; copying",
+                             self.proto_dir)
+                self.rm_work_dir()
+                _parallel_copytree(self.proto_dir, self.work_dir)
 
     def emit_metadata(self):
         """Write the package metadata files."""
         depends = ",".join(self._depends)
 
-        controlf = open(os.path.join(self.control_dir, "control"), "w")
-        try:
-            controlmsg = self._template.render(
-                pkg_name=self.name,
-                pkg_version=self.version,
-                pkg_section="opt",
-                pkg_arch=self.pkg_arch,
-                pkg_depends=depends,
-                pkg_maintainer=self.maintainer,
-                pkg_description=self.description,
-                pkg_priority="optional",
-            )
-            print(controlmsg, file=controlf)
-        except:
-            logging.error("control template issue: %s",
-                          mako.exceptions.text_error_template().render())
-
-        controlf.close()
+        controlmsg = self._render_control(
+            pkg_name=self.name,
+            pkg_version=self.version,
+            pkg_section="opt",
+            pkg_arch=self.pkg_arch,
+            pkg_depends=depends,
+            pkg_maintainer=self.maintainer,
+            pkg_description=self.description,
+            pkg_priority="optional",
+        )
+
+        with open(os.path.join(self.control_dir, "control"), "w") as controlf:
+            controlf.write(controlmsg + "\n")
 
         if self.distro == "debian":
-            for f in ["prerm", "postinst", "conffiles"]:
-                src = "build/debian-deb/%s-%s" % (self.name, f)
-                if os.path.exists(src):
-                    dst = os.path.join(self.control_dir, f)
-                    shutil.copyfile(src, dst)
-                    if f != "conffiles":
-                        os.chmod(dst, 0o755)
+            auxdir = "build/debian-deb"
         elif self.distro == "openwrt":
-            for f in ["prerm", "postinst", "conffiles"]:
-                src = "build/openwrt-ipk/%s-%s" % (self.name, f)
-                if os.path.exists(src):
-                    dst = os.path.join(self.control_dir, f)
-                    shutil.copyfile(src, dst)
-                    if f != "conffiles":
-                        os.chmod(dst, 0o755)
+            auxdir = "build/openwrt-ipk"
+        else:
+            return
+
+        # The memoized directory listing answers existence without any
+        # per-file syscalls.  The files are copied rather than
+        # hardlinked because the chmod below must not touch the
+        # checked-in sources.
+        listing = _aux_dir_listing(auxdir)
+        for f in ("prerm", "postinst", "conffiles"):
+            base = "%s-%s" % (self.name, f)
+            if base not in listing:
+                continue
+            dst = os.path.join(self.control_dir, f)
+            shutil.copyfile(os.path.join(auxdir, base), dst)
+            if f != "conffiles":
+                os.chmod(dst, 0o755)
+
+    def proto_hash_path(self):
+        """Sidecar file recording the proto hash the work dir was built
+        from; kept outside the work dir so it is never packaged."""
+        return self.work_dir + ".proto-hash"
 
     def collect_contents(self):
         """Set up the package's complete contents."""
+        tree_hash = None
+        if self.incremental:
+            tree_hash = self.content_hash(None, None)
+            try:
+                with open(self.proto_hash_path()) as f:
+                    if f.read() == tree_hash and \
+                       os.path.isdir(self.work_dir):
+                        logging.info("work dir %s matches proto area; "
+                                     "refreshing metadata only",
+                                     self.work_dir)
+                        self.emit_metadata()
+                        return
+            except OSError:
+                pass
+
         self.rm_work_dir()
         self.copy_tree()
         self.mk_work_dir()
         self.emit_metadata()
 
-    def build_package(self, compresstype="gzip", compresslevel=5):
-        """Invoke the appropriate package build utility."""
+        if self.incremental:
+            with open(self.proto_hash_path(), "w") as f:
+                f.write(tree_hash)
+
+    def content_hash(self, compresstype, compresslevel):
+        """Digest of everything that determines the built package.
+
+        Covers the control metadata, the DEBIAN aux files, and a
+        (relpath, mode, size, mtime) tuple per proto-area file, so the
+        compressed data member can be reused from the cache."""
+        h = hashlib.blake2b()
+        # self.version is deliberately excluded: it is minted from the
+        # clock every run, and folding it in would mean no two runs
+        # could ever match.
+        h.update(repr((self.name, self.pkg_arch,
+                       self._depends, self.maintainer, self.description,
+                       compresstype, compresslevel,
+                       self.in_process)).encode())
+
+        listing = _aux_dir_listing("build/debian-deb")
+        for f in ["prerm", "postinst", "conffiles"]:
+            base = "%s-%s" % (self.name, f)
+            if base in listing:
+                with open("build/debian-deb/%s" % base, "rb") as auxf:
+                    h.update(auxf.read())
+
+        for dirpath, dirnames, filenames in os.walk(self.proto_dir):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                fpath = os.path.join(dirpath, fname)
+                st = os.lstat(fpath)
+                rel = os.path.relpath(fpath, self.proto_dir)
+                h.update(("%s\0%o\0%d\0%d\n" %
+                          (rel, st.st_mode, st.st_size,
+                           st.st_mtime_ns)).encode())
+
+        return h.hexdigest()
+
+    def build_deb_in_process(self, compresslevel=5, jobs=0):
+        """Assemble the .deb with tarfile + zstandard, without forking
+        dpkg-deb.
+
+        A .deb is an ar archive of debian-binary, control.tar.zst, and
+        data.tar.zst; all three are simple enough to emit directly, and
+        the python-zstandard binding compresses multi-threaded without
+        caring about the builder's dpkg version."""
+        control_tar = self.work_dir + ".control.tar.zst"
+        data_tar = self.work_dir + ".data.tar.zst"
+        debian_binary = self.work_dir + ".debian-binary"
+
+        _write_tar(control_tar, self.control_dir,
+                   sorted(os.listdir(self.control_dir)),
+                   "zstd", compresslevel, jobs)
+        _write_tar(data_tar, self.work_dir,
+                   sorted(m for m in os.listdir(self.work_dir)
+                          if m != "DEBIAN"),
+                   "zstd", compresslevel, jobs)
+        with open(debian_binary, "wb") as dbf:
+            dbf.write(b"2.0\n")
+
+        with open(self.package_name, "wb") as arf:
+            arf.write(b"!<arch>\n")
+            _ar_member(arf, "debian-binary", debian_binary)
+            _ar_member(arf, "control.tar.zst", control_tar)
+            _ar_member(arf, "data.tar.zst", data_tar)
+
+        for tmp in (control_tar, data_tar, debian_binary):
+            os.unlink(tmp)
+
+    def assemble_deb_from_cache(self, data_path, compresstype="zstd",
+                                compresslevel=5, jobs=0):
+        """Rebuild the .deb around a cached data member.
+
+        The cache key excludes the time-minted version, so the control
+        metadata is stamped fresh here while the expensive compressed
+        data member is reused as-is."""
+        self.mk_work_dir()
+        self.emit_metadata()
 
-        if self.distro == "debian":
-            sh.fakeroot("dpkg-deb", "-Z", compresstype, "-z", compresslevel,
-                        "--build", self.work_dir, _fg=True)
+        data_member = os.path.basename(data_path).split(".", 1)[1]
+        control_member = "control.tar" + _TAR_EXTS[compresstype]
+        control_tar = self.work_dir + "." + control_member
+        debian_binary = self.work_dir + ".debian-binary"
+
+        _write_tar(control_tar, self.control_dir,
+                   sorted(os.listdir(self.control_dir)),
+                   compresstype, compresslevel, jobs)
+        with open(debian_binary, "wb") as dbf:
+            dbf.write(b"2.0\n")
+
+        with open(self.package_name, "wb") as arf:
+            arf.write(b"!<arch>\n")
+            _ar_member(arf, "debian-binary", debian_binary)
+            _ar_member(arf, control_member, control_tar)
+            _ar_member(arf, data_member, data_path)
+
+        for tmp in (control_tar, debian_binary):
+            os.unlink(tmp)
+        if not self.incremental:
+            self.rm_work_dir()
+
+    def build_package(self, compresstype="zstd", compresslevel=5, jobs=0):
+        """Invoke the appropriate package build utility.
+
+        jobs caps the compression thread count; 0 means every available
+        core."""
+
+        if self.distro == "debian" and self.in_process:
+            if compresstype != "zstd":
+                logging.info("in-process builder always compresses "
+                             "with zstd")
+            self.build_deb_in_process(compresslevel=compresslevel,
+                                      jobs=jobs)
+        elif self.distro == "debian":
+            # --root-owner-group makes dpkg-deb record root:root
+            # ownership itself, so the fakeroot shim is unnecessary.
+            if dpkg_deb_supports_root_owner_group():
+                args = ["dpkg-deb", "--root-owner-group"]
+            else:
+                args = ["fakeroot", "dpkg-deb"]
+            args += ["-Z", compresstype, "-z", str(compresslevel)]
+            if compresstype in ("xz", "zstd"):
+                # Both xz and zstd compress multi-threaded; let them use
+                # every core.  Older dpkg-deb lacks --threads-max but
+                # shells out to xz, which honors XZ_OPT.
+                if dpkg_deb_supports_zstd():
+                    args.append("--threads-max=%d" %
+                                (jobs or len(os.sched_getaffinity(0))))
+                elif compresstype == "xz":
+                    os.environ["XZ_OPT"] = "-T%d -%d" % (jobs, compresslevel)
+            # The work dir name no longer carries the version, so name
+            # the output explicitly.
+            subprocess.run(args + ["--build", self.work_dir,
+                                   self.package_name], check=True)
         elif self.distro == "openwrt":
-            sh.fakeroot("./build/openwrt-ipk/ipkg-build", self.work_dir, _fg=True)
+            subprocess.run(["fakeroot", "./build/openwrt-ipk/ipkg-build",
+                            self.work_dir], check=True)
         elif self.distro == "archive":
-            sh.fakeroot("tar", "zcvf", self.archive_name, self.work_dir, _fg=True)
+            subprocess.run(["fakeroot", "tar", "zcvf", self.archive_name,
+                            self.work_dir], check=True)
 
-        self.rm_work_dir()
+        # In incremental mode the work dir is kept for reuse by the
+        # next run; its proto-hash sidecar says whether it is current.
+        if not self.incremental:
+            self.rm_work_dir()
 
     def deb_run_lint(self):
         """Run lintian against the constructed package."""
         try:
-            sh.lintian("--no-tag-display-limit", self.package_name, _fg=True)
-        except sh.ErrorReturnCode_1:
+            subprocess.run(["lintian", "--no-tag-display-limit",
+                            self.package_name], check=True)
+        except subprocess.CalledProcessError as e:
+            if e.returncode != 1:
+                raise
             logging.warning("lintian %s returned 1", self.package_name)
 
 
@@ -301,17 +756,71 @@ class AppliancePackage(Package):
         super().__init__(distro, arch, version)
         self.proto_dir = os.path.join(proto, "appliance")
 
+    # Paths whose presence means the proto area has an initialized config
+    # store and must not be packaged.
+    dirty_paths = frozenset([
+        "opt/com.brightgate/etc/ap_props.json",
+        "data/configd/ap_props.json",
+    ])
+
     def check_proto(self):
         # prevent packaging a proto area with an initialized config store
-        ap_props = [
-            "opt/com.brightgate/etc/ap_props.json"
-            "data/configd/ap_props.json"
-        ]
-        for p in ap_props:
+        for p in self.dirty_paths:
             if os.path.exists(os.path.join(self.proto_dir, p)):
                 raise Exception("proto area looks dirty (found %s)" % p)
 
 
+def prep_one(p, opts):
+    """Probe the package cache and collect contents on a miss.
+
+    Returns (cache_key, hit): the key this build's data member should
+    be deposited under (None when caching is off) and whether a cached
+    member was already assembled into the output."""
+    logging.info("begin %s package build", p.package_name)
+
+    cache_key = None
+    if p.distro == "debian" and not opts.no_cache:
+        cache_key = p.content_hash(opts.compresstype, opts.compresslevel)
+        cached = _cache_find(cache_key)
+        if cached is not None:
+            logging.info("cache hit for %s", p.package_name)
+            p.assemble_deb_from_cache(cached,
+                                      compresstype=opts.compresstype,
+                                      compresslevel=opts.compresslevel,
+                                      jobs=opts.jobs)
+            os.utime(cached)
+            return cache_key, True
+
+    p.collect_contents()
+    return cache_key, False
+
+
+def finish_one(p, opts, cache_key, hit):
+    """Compress and deposit a prepared package, then optionally lint."""
+    if not hit:
+        p.build_package(compresstype=opts.compresstype,
+                        compresslevel=opts.compresslevel,
+                        jobs=opts.jobs)
+        if cache_key is not None:
+            os.makedirs(PKG_CACHE_DIR, exist_ok=True)
+            tmp = os.path.join(PKG_CACHE_DIR, cache_key + ".tmp")
+            member = _copy_deb_data_member(p.package_name, tmp)
+            os.replace(tmp, os.path.join(PKG_CACHE_DIR,
+                                         "%s.%s" % (cache_key, member)))
+            _prune_cache()
+
+    logging.info("end %s package build", p.name)
+
+    if opts.lint:
+        p.deb_run_lint()
+
+
+def build_one(p, opts):
+    """Collect, build, and optionally lint one package."""
+    cache_key, hit = prep_one(p, opts)
+    finish_one(p, opts, cache_key, hit)
+
+
 def main_func():
     """Main program logic"""
     packages = [CloudPackage, AppliancePackage]
@@ -321,9 +830,31 @@ def main_func():
     parser.add_argument('--distro', '-D', required=True)
     parser.add_argument('--proto', '-p', required=True)
     parser.add_argument('--lint', action='store_true')
+    parser.add_argument('--parallel', action='store_true',
+                        help="build independent packages concurrently")
+    parser.add_argument('--in-process', action='store_true',
+                        help="assemble .debs with tarfile + zstandard in "
+                             "this process instead of forking dpkg-deb")
+    parser.add_argument('--incremental', action='store_true',
+                        help="reuse an existing work dir when it matches "
+                             "the proto area (developer builds)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always rebuild, ignoring the content-hash "
+                             "package cache")
+    parser.add_argument('--copy-mode', default="hardlink",
+                        choices=["hardlink", "reflink", "copy"],
+                        help="how to populate the work dir from the proto "
+                             "area; reflink clones extents (CoW) where the "
+                             "filesystem supports it")
     parser.add_argument('--compresslevel', '-z', type=int, default=5)
-    parser.add_argument('--compresstype', '-Z', default="gzip",
-                        choices=["none", "gzip", "xz"])
+    parser.add_argument('--jobs', '-j', type=int, default=0,
+                        help="compression threads for xz/zstd; 0 means "
+                             "auto-detect from the available cores")
+    parser.add_argument('--compresstype', '-Z', default="zstd",
+                        choices=["none", "gzip", "xz", "zstd"],
+                        help="deb compressor; xz and zstd run "
+                             "multi-threaded, but need dpkg >= 1.15/1.21.18 "
+                             "respectively on the installing system")
 
     opts = parser.parse_args(sys.argv[1:])
     calver = time.strftime("%y%m%d%H%M")
@@ -333,6 +864,13 @@ def main_func():
         logging.info("auto-correcting 'raspbian' distro to 'debian'")
         opts.distro = "debian"
 
+    # The in-process builder emits zstd itself and never runs dpkg-deb,
+    # so the builder's dpkg-deb version is irrelevant to it.
+    if opts.distro == "debian" and opts.compresstype == "zstd" and \
+       not opts.in_process and not dpkg_deb_supports_zstd():
+        logging.info("dpkg-deb too old for zstd; falling back to xz")
+        opts.compresstype = "xz"
+
     if not valid_distro_arch(opts.distro, opts.arch):
         logging.info("no package output for %s on %s", opts.arch, opts.distro)
         sys.exit(0)
@@ -351,17 +889,30 @@ def main_func():
         except Exception as e:
             logging.fatal("failed proto area check: %s", e)
             sys.exit(1)
+        p.copy_mode = opts.copy_mode
+        p.incremental = opts.incremental
+        p.in_process = opts.in_process
         pkgs.append(p)
 
-    for p in pkgs:
-        logging.info("begin %s package build", p.package_name)
-        p.collect_contents()
-        p.build_package(compresstype=opts.compresstype,
-                        compresslevel=opts.compresslevel)
-        logging.info("end %s package build", p.name)
-
-        if opts.lint:
-            p.run_lint()
+    if opts.parallel and len(pkgs) > 1:
+        workers = min(len(pkgs), len(os.sched_getaffinity(0)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+            for f in [ex.submit(build_one, p, opts) for p in pkgs]:
+                f.result()
+    else:
+        # Pipeline the serial path: collect_contents is I/O-bound and
+        # build_package is CPU-bound (compression), so prep package N+1
+        # on a worker while package N compresses.  A single-worker
+        # executor rather than a bare thread, so an exception in
+        # prep_one surfaces from result() instead of dying on the
+        # worker.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
+            fut = ex.submit(prep_one, pkgs[0], opts) if pkgs else None
+            for i, p in enumerate(pkgs):
+                state = fut.result()
+                if i + 1 < len(pkgs):
+                    fut = ex.submit(prep_one, pkgs[i + 1], opts)
+                finish_one(p, opts, *state)
 
 
 if __name__ == "__main__":